@@ -39,7 +39,8 @@ setup(
         "pytest",
         "Pillow",
         "pims",
-        "docopt"
+        "docopt",
+        "psutil"
     ],
     license=about["__license__"],
     zip_safe=False,
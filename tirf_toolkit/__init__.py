@@ -1,2 +1,3 @@
-# For relative imports to work in Python 3.6
-import os, sys; sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from .api import open_image, count_particles, analyze_intensity, analyze_injection, transition_stats
+from .fluidics import Transition
+from .tirf_image import TIRFimage
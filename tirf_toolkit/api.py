@@ -0,0 +1,91 @@
+"""
+Python API of the toolkit, for embedding the analysis in other programs, e.g. to analyze
+frames right after acquisition. The functions accept numpy or dask arrays together with
+FlashGordon metadata (or names of TIFF files), and return pandas data frames without
+writing any files. The `tirf` command line tool is a thin layer over these functions.
+
+Progress messages go to the `tirf_toolkit` logger, which is silent unless configured,
+e.g. with `logging.getLogger("tirf_toolkit").setLevel(logging.INFO)` and a handler.
+"""
+from .fluidics import analyze_trace, transition_stats
+from .intensity import analyze_intensity as _analyze_intensity
+from .misc import intersection
+from .particles import count_particles as _count_particles
+from .tirf_image import TIRFimage
+
+from copy import copy
+from os import PathLike
+import dask.array as da
+import numpy as np
+import pandas as pd
+
+
+def open_image(image, metadata=None, n_frames=0):
+    """
+    Return a TIRFimage for `image`, which is either a TIRFimage, a TIFF file name (or path), a list of
+    file names of a split movie, or an array (or a list of 2D frames) with `metadata`
+    (see `TIRFimage.from_array`). With `n_frames`, only the first `n_frames` frames are used.
+    """
+    if isinstance(image, (list, tuple)) and not all(isinstance(i, (str, PathLike)) for i in image):
+        image = da.stack(image) if any(isinstance(i, da.Array) for i in image) else np.stack(image)
+
+    if isinstance(image, TIRFimage):
+        tirf_image = copy(image)
+    elif isinstance(image, (str, PathLike, list, tuple)):
+        tirf_image = TIRFimage(image)
+    else:
+        tirf_image = TIRFimage.from_array(image, metadata)
+
+    if n_frames:
+        tirf_image.data = tirf_image.data[:n_frames]
+    return tirf_image
+
+
+def count_particles(image, metadata=None, channels=None, n_frames=0, n_workers=0):
+    """
+    Count particles in each frame of the requested spectral channels (all channels by default).
+    Returns a data frame indexed by frame number, with a `time` column in seconds and a column
+    per channel, or None if none of the channels is present. See `open_image` for the accepted
+    images; with `n_workers`, frames are processed in worker processes sharing memory.
+    """
+    return _per_frame(_count_particles, open_image(image, metadata, n_frames), channels, n_workers)
+
+
+def analyze_intensity(image, metadata=None, channels=None, n_frames=0, n_workers=0):
+    """
+    Measure average intensity of each frame in the requested spectral channels (all channels
+    by default). Returns a data frame in the same format as `count_particles`.
+    """
+    return _per_frame(_analyze_intensity, open_image(image, metadata, n_frames), channels, n_workers)
+
+
+def analyze_injection(intensity, frame_time=None, n_frames=0, window='auto', decimate=1, channel="Cy3"):
+    """
+    Analyze front and back transitions of a fluidic injection. `intensity` is a data frame as
+    returned by `analyze_intensity`, or a 1D array of intensities of the spectral `channel`
+    sampled every `frame_time` seconds. Returns the analyzed data frame indexed by time in ms,
+    the analyzed channel, and `Transition` objects for the front and back edges (None if not
+    detected).
+    See `transition_stats` for a summary of the transitions.
+    """
+    if isinstance(intensity, pd.DataFrame):
+        df = intensity.set_index('time') if 'time' in intensity.columns else intensity
+    elif frame_time is None:
+        raise ValueError("frame_time is required to analyze an array of intensities")
+    else:
+        trace = np.asarray(intensity, dtype=float)
+        df = pd.DataFrame({channel: trace}, index=pd.Index(np.arange(len(trace)) * frame_time, name='time'))
+
+    return analyze_trace(df, n_frames=n_frames, window=window, decimate=decimate)
+
+
+def _per_frame(func, tirf_image, channels, n_workers):
+    ch = intersection(channels, tirf_image.channels)
+    if not ch:
+        return None
+
+    df = func(tirf_image, channels=ch, n_workers=n_workers)
+
+    df.insert(loc=0, column='time', value=tirf_image.time)
+    df.index.name = 'frame'
+    return df
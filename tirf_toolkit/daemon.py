@@ -1,17 +1,188 @@
 import webbrowser
 from glob import glob
-from os.path import splitext, exists
-from time import sleep
+from os import stat
+from os.path import splitext, exists, dirname, join, getmtime
+from time import sleep, monotonic, time
 
 from dask.distributed import Client
 from pims import UnknownFormatError
 from pandas.errors import EmptyDataError
 
-from misc import cond_run
+from .metrics import METRICS, serve_metrics
+from .misc import cond_run
+from .tirf_image import is_movie_part, find_movie_parts
 
 
-def start_daemon(output_suffix, func, dask_cluster=False, **kwargs):
+def file_key(fn):
+    """
+    Identify a version of the file by its path, modification time and size,
+    so that a file that is rewritten or replaced is treated as a new file.
+    """
+    try:
+        st = stat(fn)
+        return fn, st.st_mtime, st.st_size
+    except OSError:    # file has been removed in the meantime
+        return fn, None, None
 
+
+class FailureRegistry:
+    """
+    Keep track of files that could not be processed. A failed file is retried after
+    a delay that doubles with each failed attempt. After `max_attempts` failures the
+    file is quarantined and never retried again. Transient failures (e.g. the file is
+    still locked by the acquisition software) are retried with the same delays, but
+    never lead to quarantine.
+
+    Files are identified by their path, modification time and size (see `file_key`),
+    so a file that changes is retried from scratch. The quarantine list is stored in
+    a text file (one tab-separated key per line), so it persists across restarts.
+    """
+    def __init__(self, quarantine_file=None, max_attempts=5, base_delay=1.0, max_delay=300.0):
+        self.quarantine_file = quarantine_file
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.attempts = {}     # file key -> number of failed attempts that count toward quarantine
+        self.failures = {}     # file key -> number of all failed attempts
+        self.retry_at = {}     # file key -> earliest time of the next attempt
+        self.quarantine = set()
+
+        if quarantine_file and exists(quarantine_file):
+            with open(quarantine_file) as f:
+                for line in f:
+                    if not line.strip():   # the list may be edited by hand
+                        continue
+                    try:
+                        fn, mtime, size = line.rstrip("\n").split("\t")
+                        self.quarantine.add((fn, float(mtime), int(size)))
+                    except ValueError:
+                        print(f"Ignoring invalid line in {quarantine_file}: {line.strip()}")
+
+    def quarantined(self, fn):
+        return file_key(fn) in self.quarantine
+
+    def ready(self, fn, now=None):
+        """Check whether the file can be (re)tried now"""
+        key = file_key(fn)
+        if key in self.quarantine:
+            return False
+        now = monotonic() if now is None else now
+        return now >= self.retry_at.get(key, 0)
+
+    def failed(self, fn, now=None, transient=False):
+        """Register a failed attempt and schedule the next one, or quarantine the file"""
+        key = file_key(fn)
+        now = monotonic() if now is None else now
+        n = self.failures[key] = self.failures.get(key, 0) + 1
+        if not transient:
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+
+        if self.attempts.get(key, 0) >= self.max_attempts and key[1] is not None:
+            print(f"Giving up on {fn} after {n} attempts, adding it to quarantine")
+            self.quarantine.add(key)
+            self._forget(key)
+            self._save()
+        else:
+            delay = min(self.base_delay * 2 ** (n - 1), self.max_delay)
+            print(f"Will retry {fn} in {delay:.0f} s (attempt {n})")
+            self.retry_at[key] = now + delay
+
+    def succeeded(self, fn):
+        """Forget previous failures of the file"""
+        self._forget(file_key(fn))
+
+    def _forget(self, key):
+        self.attempts.pop(key, None)
+        self.failures.pop(key, None)
+        self.retry_at.pop(key, None)
+
+    def _save(self):
+        if self.quarantine_file:
+            with open(self.quarantine_file, "w") as f:
+                f.writelines(f"{fn}\t{mtime!r}\t{size}\n" for fn, mtime, size in sorted(self.quarantine))
+
+
+def movie_settled(tiff_file, settle, now=None):
+    """
+    Check whether acquisition of the movie starting with `tiff_file` has finished, i.e. none
+    of its parts has been modified, and no new part has appeared, for `settle` seconds.
+    """
+    now = time() if now is None else now
+    try:
+        return all(now - getmtime(f) >= settle for f in find_movie_parts(tiff_file))
+    except OSError:    # a part has been removed in the meantime
+        return False
+
+
+def process_files(output_suffix, func, registry, no_output=None, **kwargs):
+    """
+    Make one pass over the files matching the pattern, and process the files without output.
+    With `join`, continuation parts of split movies are processed together with the first part,
+    once the whole movie has settled (see `movie_settled`). Files that were processed without
+    creating an output (e.g. none of the requested channels is present) are remembered in the
+    `no_output` set and skipped, until they change.
+    """
+    no_output = set() if no_output is None else no_output
+
+    def pending():
+        # Continuation parts of split movies are processed together with the first part
+        files = [f for f in glob(kwargs["pattern"])
+                 if not (kwargs.get("join") and is_movie_part(f))
+                 and not exists(splitext(f)[0] + output_suffix)
+                 and not registry.quarantined(f)
+                 and file_key(f) not in no_output]
+        METRICS.scan(files, quarantined=len(registry.quarantine), join=kwargs.get("join"))
+        return files
+
+    for f in pending():
+        if not registry.ready(f):
+            continue
+
+        # Acquisition of the movie may still be running, more parts can appear
+        if kwargs.get("join") and not movie_settled(f, kwargs.get("settle", 30)):
+            continue
+
+        try:
+            with METRICS.stage("file"):
+                cond_run(f, output_suffix, func, **kwargs)
+
+        except PermissionError:
+            # The file is likely still open in the acquisition software
+            print(f"Don't have permissions to open {f}")
+            registry.failed(f, transient=True)
+            METRICS.done(f, ok=False)
+        except Exception as e:
+            if isinstance(e, UnknownFormatError):
+                print(f"Unknown format of file {f}")
+            elif isinstance(e, EmptyDataError):
+                print(f"No data found in {f}")
+            else:
+                print(f"Could not process file {f}, error is {repr(e)}")
+            registry.failed(f)
+            METRICS.done(f, ok=False)
+
+        else:
+            registry.succeeded(f)
+            if exists(splitext(f)[0] + output_suffix):
+                METRICS.done(f)
+            else:
+                print(f"No output created for {f}")
+                no_output.add(file_key(f))
+                METRICS.done(f, ok=None)
+
+        # Files acquired in the meantime are waiting in the queue too
+        pending()
+
+
+def start_daemon(output_suffix, func, dask_cluster=False, name=None, **kwargs):
+    """
+    Process files matching the pattern, and keep watching for new files until interrupted.
+    `name` identifies the command in the name of the quarantine list, it defaults to the
+    output suffix.
+    """
+
+    client = None
     if dask_cluster:
 
         client = Client()
@@ -20,21 +191,29 @@ def start_daemon(output_suffix, func, dask_cluster=False, **kwargs):
         if kwargs['status']:
             webbrowser.open(client.dashboard_link)
 
-    while True:
-        sleep(1)
-
-        for f in glob(kwargs["pattern"]):
-            try:
-                if not exists(f"{splitext(f)[0]}_{output_suffix}"):
-                    cond_run(f, output_suffix, func, **kwargs)
-
-            except PermissionError:
-                print("Don't have permissions to open %f" % f)
-            except UnknownFormatError:
-                print("Unknown format of file %f" % f)
-            except KeyboardInterrupt:
-                break
-            except EmptyDataError:
-                print("No data found in %f" % f)
-            except Exception as e:
-                print(f"Could not process file {f}, error is {repr(e)}")
+    # Files that fail to process repeatedly are listed next to the input files
+    name = name or splitext(output_suffix)[0].strip("_")
+    quarantine_file = join(dirname(kwargs["pattern"]), f"tirf_quarantine_{name}.txt")
+    registry = FailureRegistry(quarantine_file, max_attempts=kwargs.get("max_attempts", 5))
+
+    server = None
+    if kwargs.get("metrics"):
+        METRICS.client = client
+        METRICS.max_lag = kwargs.get("max_lag", 600)
+        server = serve_metrics(METRICS, kwargs["metrics"])
+
+    no_output = set()
+    try:
+        while True:
+            sleep(1)
+
+            process_files(output_suffix, func, registry, no_output, **kwargs)
+
+    except KeyboardInterrupt:
+        print("Stopping")
+
+    finally:
+        if server is not None:
+            server.shutdown()
+        if client is not None:
+            client.close()
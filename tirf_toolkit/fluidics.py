@@ -1,8 +1,10 @@
+import logging
 import numpy as np
 from matplotlib import pyplot as plt
 import pandas as pd
-from misc import chop_filename
-from scipy.signal import savgol_filter
+from scipy.signal import savgol_filter, savgol_coeffs, convolve
+
+log = logging.getLogger(__name__)
 
 
 
@@ -19,24 +21,24 @@ def get_edges(df : pd.DataFrame, channel="Cy3", w=0.8):
     i = np.array(df[df.peak].index)
 
     # extract front edge
-    a = i.min() - 2*w*i.ptp()
-    b = i.min() + w*i.ptp()
+    a = i.min() - 2*w*np.ptp(i)
+    b = i.min() + w*np.ptp(i)
     df["front"] = (df.index > a) & (df.index < b)
 
     # extract back edge
-    a = i.max() - w*i.ptp()
-    b = i.max() + 2*w*i.ptp()
+    a = i.max() - w*np.ptp(i)
+    b = i.max() + 2*w*np.ptp(i)
     df["back"] = (df.index > a) & (df.index < b)
     return df
 
 
 def where_eq(s, level, first=True):
     # find intersection points
-    p = pd.Series(np.diff(np.sign(s - level)) != 0, index=s.index[:-1])
+    p = np.flatnonzero(np.diff(np.sign(np.asarray(s) - level)) != 0)
     if first:
-        return p[p].index[0]
+        return s.index[p[0]]
     else:
-        return p[p].index[-1]
+        return s.index[p[-1]]
 
 
 class Transition():
@@ -81,19 +83,21 @@ class Transition():
 
 
 def analyze_transition(smooth_edge : pd.Series, margin=0.1):
+    # Work with plain numpy arrays, label-based pandas slicing is slow for long traces
+    x, y = smooth_edge.index.values, smooth_edge.values
+
     # Find midpoint
-    try:
-        x0 = where_eq(smooth_edge, 0.5*(smooth_edge.min()+smooth_edge.max()))
-    except IndexError:
+    k = np.flatnonzero(np.diff(np.sign(y - 0.5*(np.nanmin(y) + np.nanmax(y)))) != 0)
+    if len(k) == 0:
         return None
+    k = k[0]
 
-    # split into left and right
-    left = smooth_edge.loc[:x0]
-    right = smooth_edge.loc[x0:]
+    # split into left and right, both include the midpoint
+    left, right = y[:k+1], y[k:]
 
     # steady state levels
-    ls = left.median()
-    rs = right.median()
+    ls = np.nanmedian(left)
+    rs = np.nanmedian(right)
 
     up = ls < rs
 
@@ -105,10 +109,10 @@ def analyze_transition(smooth_edge : pd.Series, margin=0.1):
 
     try:
         t = Transition(
-            a = where_eq(left, lt, first=False),
-            b = where_eq(right, rt, first=True),
-            start = smooth_edge.index.min(),
-            end = smooth_edge.index.max(),
+            a = where_eq(pd.Series(left, index=x[:k+1]), lt, first=False),
+            b = where_eq(pd.Series(right, index=x[k:]), rt, first=True),
+            start = x.min(),
+            end = x.max(),
             steady_low = min(ls, rs),
             steady_high = max(ls, rs),
             thresh_low = min(lt, rt),
@@ -119,6 +123,18 @@ def analyze_transition(smooth_edge : pd.Series, margin=0.1):
         return None
 
 
+def transition_stats(front, back):
+    """Summary of the front and back transitions of an injection"""
+    return dict(
+        front_start = front.a,
+        front_tau = front.tau,
+        back_start = back.a,
+        back_tau = back.tau,
+        amp = front.ptp,
+        duration = (back.a + back.tau / 2) - (front.a + front.tau / 2),
+    )
+
+
 def show_dataset(df, channel, front, back, ax, offset=0):
     if front and back:
         d = get_edges(df, channel)
@@ -142,7 +158,7 @@ def show_dataset(df, channel, front, back, ax, offset=0):
         ax.text((front.b + back.a)/2, front.half, f"{duration:.0f} ms", ha="center")
     
     else:
-        print("Could not detect and analyze peak")
+        log.warning("Could not detect and analyze peak")
         ax.plot(df[channel], '.-', c='grey', alpha=0.2)
         ax.plot(df[channel+"s"], 'k-', lw=0.5)
 
@@ -152,8 +168,16 @@ def show_dataset(df, channel, front, back, ax, offset=0):
 
 def analyze_csv(fn, n_frames=0, **kwargs):
     df = pd.read_csv(fn, index_col='time')
+    return analyze_trace(df, n_frames=n_frames, window=kwargs.get('window', 'auto'),
+                         decimate=kwargs.get('decimate', 1))
+
+def analyze_trace(df, n_frames=0, window='auto', decimate=1):
+    """
+    Analyze injection in the intensity data frame indexed by time in seconds,
+    as saved by `tirf intensity`.
+    """
     # First five frames often contains garbage, we drop it
-    df = df.iloc[5:]
+    df = df.iloc[5:].copy()
 
     if n_frames:
         df = df.iloc[:n_frames]
@@ -161,26 +185,36 @@ def analyze_csv(fn, n_frames=0, **kwargs):
     # convert s to ms
     df.index *= 1000
 
-    return analyze_df(df, window = kwargs['window'])
+    return analyze_df(df, window = window, decimate = decimate)
+
+# Minimum number of points of the decimated trace for the multi-resolution analysis
+MIN_DECIMATED = 10
 
-def analyze_df(df, window = 'auto'):
+
+def analyze_df(df, window = 'auto', decimate = 1):
+    """
+    Find the injection peak in the strongest spectral channel and analyze its front and back
+    transitions. With `decimate` > 1, use the faster multi-resolution analysis for long traces,
+    see `analyze_df_multires`. Traces shorter than `MIN_DECIMATED` * `decimate` points are
+    analyzed at full resolution.
+    """
     # What channel contains the strongest signal?
     channel = df.filter(regex=("Cy?")).apply(np.ptp, axis=0).idxmax()
     
     # Subtract baseline
     df[channel] -= np.quantile(df[channel], 0.05)
 
+    # The decimated trace must be long enough to locate the peak, short traces are fast anyway
+    if decimate > 1 and len(df) >= MIN_DECIMATED * decimate:
+        return analyze_df_multires(df, channel, window, decimate)
+
     # Find front and back edges
     df = get_edges(df, channel=channel)
 
     # Smooth signal with savgol_filter. Window length is proportional to FWHM of the peak or the
     # length of the dataset. The window_length is at least 11 data points long
-    
-    if window == 'auto':
-        window_length = 2 * min(len(df[df.peak]) // 30, len(df) // 60) + 11
-    else:
-        window_length = int(window)
-    print("window_length: ", window_length)
+    window_length = _window_length(window, df.peak.sum(), len(df))
+    log.info("window_length: %d", window_length)
 
     df[channel + "s"] = savgol_filter(df[channel], window_length, 3)
 
@@ -188,3 +222,77 @@ def analyze_df(df, window = 'auto'):
     front = analyze_transition(df[channel + "s"][df.front])
     back = analyze_transition(df[channel + "s"][df.back])
     return df, channel, front, back
+
+
+def analyze_df_multires(df, channel, window = 'auto', decimate = 10, w = 0.8):
+    """
+    Multi-resolution version of `analyze_df` for very long traces. The peak and the front and
+    back edge windows are located on a trace decimated `decimate` times (by averaging blocks of
+    `decimate` points). The transitions are then analyzed on the trace smoothed at full resolution,
+    but only inside the edge windows. The smoothed column is NaN outside the edge windows.
+
+    Within the edge windows, the smoothed signal is identical to the full-resolution analysis.
+    The edge windows and the automatic window length are estimated on the decimated trace, so
+    the transition timings deviate from the full-resolution analysis by at most
+    max(1, `decimate` / 2) samples.
+    """
+    x, y = df.index.values, df[channel].values
+    n = len(y) // decimate * decimate
+
+    # Locate the peak and the edge windows on the decimated trace
+    xd = x[:n].reshape(-1, decimate).mean(axis=1)
+    yd = y[:n].reshape(-1, decimate).mean(axis=1)
+    peak = yd > 0.5*(yd.min() + yd.max())
+    i = xd[peak]
+
+    front = (i.min() - 2*w*np.ptp(i), i.min() + w*np.ptp(i))
+    back = (i.max() - w*np.ptp(i), i.max() + 2*w*np.ptp(i))
+
+    df["peak"] = y > 0.5*(yd.min() + yd.max())
+    df["front"] = (x > front[0]) & (x < front[1])
+    df["back"] = (x > back[0]) & (x < back[1])
+
+    window_length = _window_length(window, peak.sum() * decimate, len(df))
+    log.info("window_length: %d", window_length)
+
+    # Smooth signal at full resolution inside the edge windows only
+    smooth = np.full(len(y), np.nan)
+    transitions = []
+    for a, b in [front, back]:
+        lo, hi = np.searchsorted(x, a, side='right'), np.searchsorted(x, b, side='left')
+        smooth[lo:hi] = _savgol_segment(y, lo, hi, window_length)
+        transitions.append(analyze_transition(pd.Series(smooth[lo:hi], index=x[lo:hi])))
+
+    df[channel + "s"] = smooth
+    return df, channel, *transitions
+
+
+def _window_length(window, n_peak, n):
+    """Window length for savgol_filter, proportional to the peak width or the trace length"""
+    if window == 'auto':
+        return 2 * min(n_peak // 30, n // 60) + 11
+    return int(window)
+
+
+def _savgol_segment(y, lo, hi, window_length, polyorder=3):
+    """
+    Compute `savgol_filter(y, window_length, polyorder)[lo:hi]` without smoothing the whole trace.
+    The segment is padded by half of the window, so that the result matches the full trace exactly.
+    Interior points are computed as a convolution, which scipy does with FFT for long windows.
+    """
+    h = window_length // 2
+    lo_, hi_ = max(lo - h, 0), min(hi + h, len(y))
+    if hi_ - lo_ < window_length or window_length % 2 == 0:
+        return savgol_filter(y, window_length, polyorder)[lo:hi]
+
+    seg = y[lo_:hi_]
+    smooth = np.empty(len(seg))
+    smooth[h:len(seg) - h] = convolve(seg, savgol_coeffs(window_length, polyorder), mode='valid')
+
+    # Points near the ends of the trace are evaluated by fitting a polynomial, as savgol_filter does
+    if lo_ == 0:
+        smooth[:h] = savgol_filter(seg[:window_length], window_length, polyorder)[:h]
+    if hi_ == len(y):
+        smooth[len(seg) - h:] = savgol_filter(seg[-window_length:], window_length, polyorder)[window_length - h:]
+
+    return smooth[lo - lo_:hi - lo_]
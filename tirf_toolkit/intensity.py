@@ -1,36 +1,38 @@
-from misc import parse_args, cond_run, intersection
-from tirf_image import TIRFimage
+from .tirf_image import TIRFimage
+from .metrics import METRICS
+from .pipeline import map_frames
+import numpy as np
 import pandas as pd
 
 
-def analyze_intensity(tirf_image: TIRFimage, channels=None):
+def frame_intensity(frames, slices):
+    """
+    Mean intensity of each frame in a chunk, separately in each spectral channel.
+    Runs in the worker processes of `map_frames`. Returns an array of shape
+    (number of frames, number of channels).
+    """
+    return np.stack([frames[s].mean(axis=(-1, -2)) for s in slices], axis=1)
+
+
+def analyze_intensity(tirf_image: TIRFimage, channels=None, n_workers=0):
     """
     Count particles in each spectral channel of a TIFF stack. Each channel
     is segmented with an individual threshold computed based on the first frame.
-    Returns a pandas data frame with columns representing spectral channels
+    Returns a pandas data frame with columns representing spectral channels.
+    With `n_workers`, the frames are processed in worker processes that receive
+    them through shared memory (see `map_frames`) instead of with Dask.
     """
+    if n_workers:
+        with METRICS.stage("intensity"):
+            means = map_frames(tirf_image.data, frame_intensity, n_workers=n_workers,
+                               slices=[tirf_image.metadata[f"{ch}_slice"] for ch in channels])
+        return pd.DataFrame(means, columns=channels)
 
     ch_int = {}
     # Compute mean value across all the columns in a frame, per spectral channel
     for channel in channels:
-        ch_int[channel] = getattr(tirf_image, channel).mean(axis=(-1, -2)).compute()
+        with METRICS.stage("intensity"):
+            ch_int[channel] = getattr(tirf_image, channel).mean(axis=(-1, -2)).compute()
 
     return pd.DataFrame.from_dict(ch_int)
 
-
-def tiff_analyze_intensity(tiff_file, csv_file, channels=None, n_frames=0, **kwargs):
-    """
-    Measure average intensity of each frame in each spectral channel of a TIFF file.
-    Saves result in a CSV file.
-    """
-    tirf_image = TIRFimage(tiff_file)
-
-    if n_frames:
-        tirf_image.data = tirf_image.data[:n_frames]
-
-    ch = intersection(channels, tirf_image.channels)
-
-    if ch:
-        df = analyze_intensity(tirf_image, channels=ch)
-        df.insert(loc=0, column='time', value=df.index*tirf_image.frameTime)
-        df.to_csv(csv_file, float_format='% 12.3f', index_label='frame')
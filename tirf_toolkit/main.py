@@ -23,8 +23,15 @@ Options:
   -p --pattern=PTRN    Pattern for input file names, without extension [default: *]
   -n --n_frames=N      Maximum number of data points to process; zero means no limit [default: 0].
   -s --status          Open Dask dashboard to see the status of computing
+  --shm=N              Process frames in N worker processes sharing memory with the reader, instead of Dask [default: 0]
+  -j --join            Treat <name>_1.tif, <name>_2.tif, ... as continuation parts of <name>.tif
+  --settle=SEC         With --join, process a movie once none of its parts changed for SEC seconds [default: 30]
+  -m --max_attempts=N  Number of attempts to process a file before it is quarantined [default: 5]
+  --metrics=PORT       Serve metrics and health check on http://127.0.0.1:PORT; zero disables it [default: 0]
+  --max_lag=SEC        Health check fails when a file waits longer than SEC seconds [default: 600]
   -a --align=T/F       For injection plot: align t=0 with the start of injection [default: true]
   -w --window=LENGH    Window length for Savitsky-Golay filter [default: 19]
+  -d --decimate=Q      For injection analysis: locate the peak on a trace decimated Q times [default: 1]
   -h --help            Show this screen.
   -v --version         Show version.
 
@@ -32,93 +39,120 @@ Author: {author}, {email}
 Version: {version}
 """
 
-from daemon import start_daemon
-from fluidics import analyze_csv, show_dataset
-from intensity import tiff_analyze_intensity
-from misc import parse_args, intersection, chop_filename
-from particles import tiff_count_particles
+from . import api
+from .daemon import start_daemon
+from .fluidics import analyze_csv, show_dataset, transition_stats
+from .metrics import METRICS
+from .misc import parse_args, intersection, chop_filename
+from .tirf_image import find_movie_parts
 
 from glob import glob
+import logging
 from matplotlib import pyplot as plt
 from os.path import splitext, basename, dirname, join
 import pandas as pd
+from time import time
 
 
-def main():
-    kwargs = parse_args(__doc__)
+def tiff_count_particles(tiff_file, csv_file, channels=None, n_frames=0, join=False, shm=0, **kwargs):
+    """
+    Count particles in each spectral channel of a TIFF file.
+    Saves result in a CSV file. With `join`, continuation parts of a split
+    acquisition are analyzed together with `tiff_file` as one movie. With `shm`,
+    the frames are processed in `shm` worker processes sharing memory with the reader.
+    """
+    t = time()
+    df = api.count_particles(find_movie_parts(tiff_file) if join else tiff_file,
+                             channels=channels, n_frames=n_frames, n_workers=shm)
+    if df is not None:
+        METRICS.add_frames(len(df), time() - t)
+        df.to_csv(csv_file, float_format='% 12.3f')
 
-    if kwargs["particles"]:
-        kwargs["pattern"] += ".tif"
-        start_daemon("_N_particles.csv", tiff_count_particles, dask_cluster=True, **kwargs)
 
-    if kwargs["particles_plot"]:
+def tiff_analyze_intensity(tiff_file, csv_file, channels=None, n_frames=0, join=False, shm=0, **kwargs):
+    """
+    Measure average intensity of each frame in each spectral channel of a TIFF file.
+    Saves result in a CSV file. Options are the same as for `tiff_count_particles`.
+    """
+    t = time()
+    df = api.analyze_intensity(find_movie_parts(tiff_file) if join else tiff_file,
+                               channels=channels, n_frames=n_frames, n_workers=shm)
+    if df is not None:
+        METRICS.add_frames(len(df), time() - t)
+        df.to_csv(csv_file, float_format='% 12.3f')
 
-        kwargs["pattern"] += "_N_particles.csv"
 
-        def plot_csv(fn, outfile, n_frames=0, **kwargs):
-            df = pd.read_csv(fn, index_col='time')
-            # First frame is usually garbage, drop it
-            df = df.iloc[1:]
+def plot_particles_csv(fn, outfile, channels=None, n_frames=0, **kwargs):
+    df = pd.read_csv(fn, index_col='time')
+    # First frame is usually garbage, drop it
+    df = df.iloc[1:]
+
+    if n_frames:
+        df = df.iloc[:n_frames]
+
+    # convert s to ms
+    df.index *= 1000
+
+    ch = intersection(channels, df.filter(regex="Cy?").columns)
+
+    plt.figure(figsize=(7, 4))
+
+    for channel in ch:
+        plt.plot(df[channel], label=channel)
+
+    plt.title(splitext(basename(fn))[0])
+    plt.legend()
+    plt.xlabel("time / ms")
+    plt.ylabel("Number of particles")
+    plt.savefig(outfile, dpi=200)
+    plt.close()
 
-            if n_frames:
-                df = df.iloc[:n_frames]
 
-            # convert s to ms
-            df.index *= 1000
+def plot_injection_csv(fn, outfile, align=True, **kwargs):
+    df, channel, front, back = analyze_csv(fn, **kwargs)
+    ax = plt.figure(figsize=(7, 4)).gca()
 
-            ch = intersection(kwargs["channels"], df.filter(regex="Cy?").columns)
+    offset = front.a if front and align else 0
+    show_dataset(df, channel, front, back, ax, offset=offset)
+    plt.title(chop_filename(fn))
+    plt.savefig(outfile, dpi=200)
+    plt.close()
 
-            plt.figure(figsize=(7, 4))
 
-            for channel in ch:
-                plt.plot(df[channel], label=channel)
+def main():
+    kwargs = parse_args(__doc__)
+
+    # Show progress messages of the analysis on the console
+    log = logging.getLogger("tirf_toolkit")
+    log.addHandler(logging.StreamHandler())
+    log.setLevel(logging.INFO)
 
-            plt.title(splitext(basename(fn))[0])
-            plt.legend()
-            plt.xlabel("time / ms")
-            plt.ylabel("Number of particles")
-            plt.savefig(outfile, dpi=200)
-            plt.close()
+    if kwargs["particles"]:
+        kwargs["pattern"] += ".tif"
+        start_daemon("_N_particles.csv", tiff_count_particles, name="particles", dask_cluster=not kwargs["shm"], **kwargs)
 
-        start_daemon(".png", plot_csv, **kwargs)
+    if kwargs["particles_plot"]:
+        kwargs["pattern"] += "_N_particles.csv"
+        start_daemon(".png", plot_particles_csv, name="particles_plot", **kwargs)
 
     if kwargs["intensity"]:
         kwargs["pattern"] += ".tif"
-        start_daemon("_intensity.csv", tiff_analyze_intensity, dask_cluster=True, **kwargs)
+        start_daemon("_intensity.csv", tiff_analyze_intensity, name="intensity", dask_cluster=not kwargs["shm"], **kwargs)
 
     if kwargs["injection_plot"]:
         kwargs["pattern"] += "_intensity.csv"
-
-        def plot_csv(fn, outfile, **kwargs):
-            df, channel, front, back = analyze_csv(fn, **kwargs)
-            ax = plt.figure(figsize=(7, 4)).gca()
-
-            offset = front.a if front and kwargs["align"] else 0
-            show_dataset(df, channel, front, back, ax, offset=offset)
-            plt.title(chop_filename(fn))
-            plt.savefig(outfile, dpi=200)
-            plt.close()
-
-        start_daemon(".png", plot_csv, **kwargs)
+        start_daemon(".png", plot_injection_csv, name="injection_plot", **kwargs)
 
     if kwargs["injection_stats"]:
         kwargs["pattern"] += "_intensity.csv"
 
         data = []
         for fn in glob(kwargs["pattern"]):
-            df, channel, front, back = analyze_csv(fn)
-            data.append(dict(
-                filename = chop_filename(fn),
-                front_start = front.a,
-                front_tau = front.tau,
-                back_start = back.a,
-                back_tau = back.tau,
-                amp = front.ptp,
-                duration = (back.a + back.tau / 2) - (front.a + front.tau / 2),
-            ))
+            df, channel, front, back = analyze_csv(fn, **kwargs)
+            data.append(dict(filename = chop_filename(fn), **transition_stats(front, back)))
 
         pd.DataFrame.from_dict(data).to_csv(join(dirname(fn), "injection_stats.csv"), index=False, float_format='% 12.3f')
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,204 @@
+import json
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import getmtime
+from time import time, perf_counter
+
+import psutil
+
+from .tirf_image import find_movie_parts
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = [0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800, float("inf")]
+
+
+class Metrics:
+    """
+    Thread-safe collection of the daemon metrics. The daemon updates it while processing
+    files; `serve_metrics` exposes it over HTTP in the Prometheus text format (/metrics),
+    together with a health check (/health). The daemon is considered to fall behind the
+    acquisition when a file has been waiting in the queue for longer than `max_lag` seconds.
+    """
+    def __init__(self, max_lag=600, client=None):
+        self.max_lag = max_lag
+        self.client = client   # Dask client, used to query memory of the workers
+        self.lock = threading.Lock()
+
+        self.pending = {}      # file name -> modification time (of the newest part with `join`)
+        self.processed = 0
+        self.failed = 0
+        self.no_output = 0
+        self.quarantined = 0
+        self.frames = 0
+        self.fps = 0.0
+        self.last_scan = time()
+        self.histograms = {}   # stage -> [bucket counts, sum, count]
+
+    def scan(self, files, quarantined=0, join=False):
+        """
+        Register the files waiting to be processed. With `join`, the files are first parts
+        of split movies, and a movie waits since the last modification of any of its parts.
+        """
+        pending = {}
+        for f in files:
+            try:
+                pending[f] = max(getmtime(p) for p in find_movie_parts(f)) if join else getmtime(f)
+            except OSError:    # file has been removed in the meantime
+                pass
+
+        with self.lock:
+            self.pending = pending
+            self.quarantined = quarantined
+            self.last_scan = time()
+
+    def done(self, fn, ok=True):
+        """Register a processed (`ok`) or failed file, or a file processed without output (`ok` is None)"""
+        with self.lock:
+            self.pending.pop(fn, None)
+            if ok is None:
+                self.no_output += 1
+            elif ok:
+                self.processed += 1
+            else:
+                self.failed += 1
+
+    def add_frames(self, n_frames, seconds):
+        """Register `n_frames` frames processed in `seconds`"""
+        with self.lock:
+            self.frames += n_frames
+            self.fps = n_frames / seconds if seconds > 0 else 0.0
+
+    def observe(self, stage, seconds):
+        """Add a latency measurement of a processing stage to its histogram"""
+        with self.lock:
+            counts, total, n = self.histograms.get(stage, [[0] * len(BUCKETS), 0.0, 0])
+            counts = [c + (seconds <= le) for c, le in zip(counts, BUCKETS)]
+            self.histograms[stage] = [counts, total + seconds, n + 1]
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the run time of the code block as a processing stage"""
+        t = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - t)
+
+    def lag(self):
+        """Time in seconds the oldest file has been waiting in the queue"""
+        with self.lock:
+            return max([time() - t for t in self.pending.values()], default=0.0)
+
+    def health(self):
+        lag = self.lag()
+        with self.lock:
+            return dict(
+                status="ok" if lag <= self.max_lag else "behind",
+                queue_depth=len(self.pending),
+                oldest_pending_seconds=round(lag, 3),
+                last_scan_seconds_ago=round(time() - self.last_scan, 3),
+            )
+
+    def memory(self):
+        """
+        Resident memory of the Dask workers, or without a Dask cluster, of this process
+        and its child processes (e.g. the shared-memory workers of `map_frames`)
+        """
+        if self.client is not None:
+            try:
+                workers = self.client.scheduler_info()["workers"].values()
+                return {str(w.get("name")): w["metrics"]["memory"] for w in workers}
+            except Exception:  # scheduler is not reachable, e.g. during shutdown
+                return {}
+
+        process = psutil.Process()
+        memory = {"main": process.memory_info().rss}
+        for child in process.children(recursive=True):
+            try:
+                memory[f"pid{child.pid}"] = child.memory_info().rss
+            except psutil.Error:   # process has exited in the meantime
+                pass
+        return memory
+
+    def render(self):
+        """Format the metrics in the Prometheus text exposition format"""
+        lag = self.lag()
+        memory = self.memory()
+
+        with self.lock:
+            lines = [
+                "# HELP tirf_queue_depth Number of files waiting to be processed",
+                "# TYPE tirf_queue_depth gauge",
+                f"tirf_queue_depth {len(self.pending)}",
+                "# HELP tirf_oldest_pending_seconds Time the oldest file has been waiting",
+                "# TYPE tirf_oldest_pending_seconds gauge",
+                f"tirf_oldest_pending_seconds {lag:.3f}",
+                "# HELP tirf_files_processed_total Number of successfully processed files",
+                "# TYPE tirf_files_processed_total counter",
+                f"tirf_files_processed_total {self.processed}",
+                "# HELP tirf_files_failed_total Number of failed attempts to process a file",
+                "# TYPE tirf_files_failed_total counter",
+                f"tirf_files_failed_total {self.failed}",
+                "# HELP tirf_files_no_output_total Number of files processed without creating an output",
+                "# TYPE tirf_files_no_output_total counter",
+                f"tirf_files_no_output_total {self.no_output}",
+                "# HELP tirf_files_quarantined Number of files in quarantine",
+                "# TYPE tirf_files_quarantined gauge",
+                f"tirf_files_quarantined {self.quarantined}",
+                "# HELP tirf_frames_total Number of processed frames",
+                "# TYPE tirf_frames_total counter",
+                f"tirf_frames_total {self.frames}",
+                "# HELP tirf_frames_per_second Processing speed of the last file",
+                "# TYPE tirf_frames_per_second gauge",
+                f"tirf_frames_per_second {self.fps:.3f}",
+                "# HELP tirf_stage_duration_seconds Latency of the processing stages",
+                "# TYPE tirf_stage_duration_seconds histogram",
+            ]
+            for stage, (counts, total, n) in sorted(self.histograms.items()):
+                for c, le in zip(counts, BUCKETS):
+                    le = "+Inf" if le == float("inf") else le
+                    lines.append(f'tirf_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} {c}')
+                lines.append(f'tirf_stage_duration_seconds_sum{{stage="{stage}"}} {total:.6f}')
+                lines.append(f'tirf_stage_duration_seconds_count{{stage="{stage}"}} {n}')
+
+        lines += [
+            "# HELP tirf_worker_memory_bytes Resident memory of the worker processes",
+            "# TYPE tirf_worker_memory_bytes gauge",
+        ]
+        lines += [f'tirf_worker_memory_bytes{{worker="{w}"}} {m}' for w, m in sorted(memory.items())]
+        return "\n".join(lines) + "\n"
+
+
+# Metrics of the running process. `start_daemon` configures it and starts the HTTP endpoint.
+METRICS = Metrics()
+
+
+def serve_metrics(metrics, port, host="127.0.0.1"):
+    """
+    Start an HTTP server in a background thread, serving the metrics at /metrics
+    and the health check at /health (status 503 when processing falls behind).
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                status, ctype, body = 200, "text/plain; version=0.0.4", metrics.render()
+            elif self.path == "/health":
+                h = metrics.health()
+                status, ctype, body = 200 if h["status"] == "ok" else 503, "application/json", json.dumps(h)
+            else:
+                status, ctype, body = 404, "text/plain", "Not found\n"
+
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass  # don't flood stdout with scraper requests
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics available at http://{host}:{server.server_port}/metrics")
+    return server
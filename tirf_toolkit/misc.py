@@ -1,6 +1,6 @@
 from docopt import docopt
 from os.path import splitext, exists, basename
-import __version__ as meta
+from . import __version__ as meta
 
 def parse_args(doc):
     """
@@ -24,6 +24,12 @@ def parse_args(doc):
 
     # Convert numeric options to numbers
     kwargs["n_frames"] = int(kwargs["n_frames"])
+    kwargs["max_attempts"] = int(kwargs["max_attempts"])
+    kwargs["metrics"] = int(kwargs["metrics"])
+    kwargs["max_lag"] = float(kwargs["max_lag"])
+    kwargs["decimate"] = int(kwargs["decimate"])
+    kwargs["shm"] = int(kwargs["shm"])
+    kwargs["settle"] = float(kwargs["settle"])
 
     # Convert true / false text to boolean
     kwargs["align"] = True if kwargs["align"].lower() in ["true", "t", "1"] else False
@@ -1,14 +1,18 @@
-from misc import parse_args, cond_run, intersection
-from tirf_image import TIRFimage
-from flat_field import get_flat_frame
+from .tirf_image import TIRFimage
+from .flat_field import get_flat_frame
+from .metrics import METRICS
+from .pipeline import map_frames
 
 from scipy.ndimage import maximum_filter
+import logging
 import numpy as np
 import pandas as pd
 
 
 from time import time
 
+log = logging.getLogger(__name__)
+
 def segment_particles(layer, threshold):
     """
     Threshold the image to select bright particles and apply maximum filter
@@ -16,16 +20,32 @@ def segment_particles(layer, threshold):
     particle.
     """
     masked_layer = layer * (layer > threshold)
-    return maximum_filter(layer, size=3) == masked_layer
+    # Filter each frame separately, the layer may hold several frames
+    return maximum_filter(layer, size=(1,) * (layer.ndim - 2) + (3, 3)) == masked_layer
 
 
-def count_particles(tirf_image: TIRFimage, channels=None):
+def count_frame_particles(frames, slices, flat_frames, biases, thresholds):
+    """
+    Count particles in each frame of a chunk, separately in each spectral channel.
+    Runs in the worker processes of `map_frames`. Returns an array of shape
+    (number of frames, number of channels).
+    """
+    counts = [[segment_particles(frame[s] - flat_frame + bias, thresh).sum()
+               for s, flat_frame, bias, thresh in zip(slices, flat_frames, biases, thresholds)]
+              for frame in frames]
+    return np.array(counts, dtype=int).reshape(len(frames), len(slices))
+
+
+def count_particles(tirf_image: TIRFimage, channels=None, n_workers=0):
     """
     Count particles in each spectral channel of a TIFF stack. Each channel
     is segmented with an individual threshold computed based on the first five frames.
-    Returns a pandas data frame with columns representing spectral channels
+    Returns a pandas data frame with columns representing spectral channels.
+    With `n_workers`, the stack is segmented in worker processes that receive
+    the frames through shared memory (see `map_frames`) instead of with Dask.
     """
     ch_n_particles = {}
+    flat_frames, biases, thresholds = [], [], []
 
     for channel in channels:
         # Compute an average frame from the first five frames
@@ -33,52 +53,54 @@ def count_particles(tirf_image: TIRFimage, channels=None):
 
         # Calculate and subtract the flat frame. We add a constant bias (mean value of the flat frame)
         # to avoid getting negative numbers with uint16 data type.
-        print("  ", time(), "Getting flat frame")
-        flat_frame = get_flat_frame(stack)
-        print("  ", time(), "Subtracting flat frame")
-        stack = stack - flat_frame + flat_frame.mean()
-        print("  ", time(), "Getting the subset for threshold calculation")
+        log.info("   %f Getting flat frame", time())
+        with METRICS.stage("flat_frame"):
+            flat_frame = get_flat_frame(stack)
+        log.info("   %f Subtracting flat frame", time())
+        bias = flat_frame.mean()
+        stack = stack - flat_frame + bias
+        log.info("   %f Getting the subset for threshold calculation", time())
 
         # Create a small representative data subset to estimate the threshold
         n, h, w = stack.shape
         dh, dw = np.min([100, h // 2]), np.min([100, w // 2])
         subset = stack[
-                 ::n // 10,                # 10 frames sampled across the stack
+                 ::max(n // 10, 1),        # 10 frames sampled across the stack
                  h // 2 - dh:h // 2 + dh,  # at most 200x200 pixels, from FOV center
                  w // 2 - dw:w // 2 + dw
                  ]
 
         # Threshold calculation
-        print("  ", time(), "Computing quantiles")
-        q25, q75, q90 = np.quantile(subset.compute(), [0.25, 0.75, 0.9])
+        log.info("   %f Computing quantiles", time())
+        with METRICS.stage("threshold"):
+            q25, q75, q90 = np.quantile(subset.compute(), [0.25, 0.75, 0.9])
 
         # Background occupies at least 90% of the area. On top of that,
         # we add 3x IQRs, which is a pretty conservative metric
         thresh = q90 + 10*(q75 - q25)
 
-        print("  ", time(), "Segmenting stack with threshold =", thresh)
+        if n_workers:
+            # All channels are segmented at once below, reading each frame only once
+            flat_frames.append(flat_frame)
+            biases.append(bias)
+            thresholds.append(thresh)
+            continue
+
+        log.info("   %f Segmenting stack with threshold = %s", time(), thresh)
         # Create a stack containing one white pixel per each detected particle
         segmented_stack = stack.map_blocks(segment_particles, threshold=thresh)
 
         # Now count number of white pixels in each frame
-        ch_n_particles[channel] = segmented_stack.sum(axis=(1, 2)).compute()
+        with METRICS.stage("segmentation"):
+            ch_n_particles[channel] = segmented_stack.sum(axis=(1, 2)).compute()
 
-    return pd.DataFrame.from_dict(ch_n_particles)
+    if n_workers:
+        log.info("   %f Segmenting stack in %d processes with thresholds = %s", time(), n_workers, thresholds)
+        with METRICS.stage("segmentation"):
+            counts = map_frames(tirf_image.data, count_frame_particles, n_workers=n_workers,
+                                slices=[tirf_image.metadata[f"{ch}_slice"] for ch in channels],
+                                flat_frames=flat_frames, biases=biases, thresholds=thresholds)
+        ch_n_particles = dict(zip(channels, counts.T))
 
+    return pd.DataFrame.from_dict(ch_n_particles)
 
-def tiff_count_particles(tiff_file, csv_file, channels=None, n_frames=0, **kwargs):
-    """
-    Count particles in each spectral channel of a TIFF file.
-    Saves result in a CSV file.
-    """
-    tirf_image = TIRFimage(tiff_file)
-
-    if n_frames:
-        tirf_image.data = tirf_image.data[:n_frames]
-
-    ch = intersection(channels, tirf_image.channels)
-
-    if ch:
-        df = count_particles(tirf_image, channels=ch)
-        df.insert(loc=0, column='time', value=df.index * tirf_image.frameTime)
-        df.to_csv(csv_file, float_format='% 12.3f', index_label='frame')
@@ -0,0 +1,81 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+import numpy as np
+
+
+# State of a worker process: the shared ring buffer and the function applied to the frames
+_worker = {}
+
+
+def _init_worker(shm_name, shape, dtype, func, func_kwargs):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker.update(
+        shm=shm,
+        buffer=np.ndarray(shape, dtype=dtype, buffer=shm.buf),
+        func=func,
+        kwargs=func_kwargs,
+    )
+
+
+def _process_slot(slot, n):
+    # Zero-copy view of the frames in the shared memory
+    frames = _worker["buffer"][slot, :n]
+    return _worker["func"](frames, **_worker["kwargs"])
+
+
+def map_frames(stack, func, n_workers=4, chunk_size=4, n_slots=None, **func_kwargs):
+    """
+    Apply `func(frames, **func_kwargs)` to chunks of `chunk_size` frames of the stack in
+    `n_workers` processes, and concatenate the results in the order of the frames.
+
+    The calling process reads and decodes the frames into a ring buffer of `n_slots` chunks
+    in shared memory. The workers attach to the buffer once and read the frames without
+    copying, so only the slot number goes to the workers, and only the small per-frame
+    results (`func` returns an array with one row per frame) come back. Each slot is
+    reused as soon as its chunk is processed.
+    """
+    n_slots = n_slots or 2 * n_workers
+    n, h, w = stack.shape
+    if n == 0:
+        # Let `func` define the shape of the (empty) result
+        return func(np.zeros((0, h, w), dtype=stack.dtype), **func_kwargs)
+
+    shape = (n_slots, chunk_size, h, w)
+    dtype = np.dtype(stack.dtype)
+
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * dtype.itemsize)
+    buffer = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    try:
+        with ProcessPoolExecutor(n_workers, initializer=_init_worker,
+                                 initargs=(shm.name, shape, dtype, func, func_kwargs)) as pool:
+            free = list(range(n_slots))
+            chunks = iter(range(0, n, chunk_size))
+            pending = {}   # future -> (slot, first frame of the chunk)
+            results = {}   # first frame of the chunk -> result
+
+            while True:
+                # Fill free slots with the next chunks of frames
+                while free:
+                    start = next(chunks, None)
+                    if start is None:
+                        break
+                    slot = free.pop()
+                    frames = np.asarray(stack[start:start + chunk_size])
+                    buffer[slot, :len(frames)] = frames
+                    pending[pool.submit(_process_slot, slot, len(frames))] = (slot, start)
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    slot, start = pending.pop(future)
+                    results[start] = future.result()
+                    free.append(slot)
+
+        return np.concatenate([results[start] for start in sorted(results)])
+
+    finally:
+        del buffer   # release the view, otherwise the shared memory cannot be closed
+        shm.close()
+        shm.unlink()
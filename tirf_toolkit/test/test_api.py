@@ -0,0 +1,61 @@
+import pytest
+from os.path import join
+from tirf_toolkit import count_particles, analyze_intensity, analyze_injection, transition_stats
+from tirf_toolkit.fluidics import analyze_csv
+from tirf_toolkit.metrics import METRICS
+import numpy as np
+import pandas as pd
+
+
+METADATA = {
+    "frameTime": 0.01,
+    "fieldArrangement": "[1,2]",
+    "channel1.name": "Cy3",
+    "channel2.name": "Cy5",
+}
+
+
+def test_arrays(capsys):
+    frames_total = METRICS.frames
+    frames = np.random.default_rng(0).normal(100, 5, (10, 16, 32)).astype(np.uint16)
+    frames[:, 4::8, 4:16:8] += 1000   # particles in Cy3 only
+
+    df = count_particles(frames, METADATA)
+    assert list(df.columns) == ["time", "Cy3", "Cy5"]
+    assert df.index.name == "frame"
+    assert np.allclose(df.time, np.arange(10) * 0.01)
+    assert (df.Cy3 == 4).all()
+
+    df = analyze_intensity(frames, METADATA, channels=["Cy5", "Cy7"], n_frames=5)
+    assert list(df.columns) == ["time", "Cy5"]
+    assert np.allclose(df.Cy5, frames[:5, :, 16:].mean(axis=(1, 2)))
+
+    assert count_particles(frames, METADATA, channels=["Cy7"]) is None
+
+    # A list of frames works the same as an array
+    assert count_particles(list(frames), METADATA).equals(count_particles(frames, METADATA))
+
+    # Nothing is printed, progress goes to the logger, and the daemon metrics are untouched
+    assert capsys.readouterr().out == ""
+    assert METRICS.frames == frames_total
+
+
+def test_injection():
+    fn = join("tirf_toolkit", "test", "data", "intensity", "test_000_intensity.csv")
+    _, _, front, back = analyze_csv(fn, window=19)
+
+    # The same data, as returned by `analyze_intensity` or as a plain array
+    df = pd.read_csv(fn, index_col="frame")
+    _, _, front_df, back_df = analyze_injection(df, window=19)
+    _, _, front_arr, back_arr = analyze_injection(df.Cy3.values, frame_time=df.time[1], window=19)
+
+    stats = transition_stats(front, back)
+    assert transition_stats(front_df, back_df) == stats
+    assert transition_stats(front_arr, back_arr) == stats
+
+    # The array is analyzed as the given channel
+    _, channel, _, _ = analyze_injection(df.Cy3.values, frame_time=df.time[1], window=19, channel="Cy5")
+    assert channel == "Cy5"
+
+    with pytest.raises(ValueError):
+        analyze_injection(df.Cy3.values, window=19)
@@ -0,0 +1,147 @@
+import os
+from time import time
+from tirf_toolkit.daemon import FailureRegistry, process_files
+from tirf_toolkit.metrics import METRICS
+from tirf_toolkit.tirf_image import find_movie_parts
+
+
+def test_failure_backoff(tmp_path):
+    fn = str(tmp_path / "a.tif")
+    open(fn, "w").close()
+
+    registry = FailureRegistry(max_attempts=5, base_delay=1.0, max_delay=3.0)
+    assert registry.ready(fn, now=0)
+
+    registry.failed(fn, now=0)
+    assert not registry.ready(fn, now=0.5)
+    assert registry.ready(fn, now=1)
+
+    registry.failed(fn, now=1)
+    assert not registry.ready(fn, now=2.5)
+    assert registry.ready(fn, now=3)
+
+    # The delay does not grow beyond max_delay
+    registry.failed(fn, now=3)
+    assert registry.ready(fn, now=6)
+
+    registry.succeeded(fn)
+    assert registry.ready(fn, now=6)
+    assert not registry.attempts
+
+
+def test_transient_failures(tmp_path):
+    fn = str(tmp_path / "a.tif")
+    open(fn, "w").close()
+
+    # A file locked by the acquisition software is never quarantined
+    registry = FailureRegistry(max_attempts=2)
+    for i in range(10):
+        registry.failed(fn, now=1000 * i, transient=True)
+    assert not registry.quarantined(fn)
+    assert registry.ready(fn, now=10**6)
+
+
+def test_quarantine(tmp_path):
+    fn = str(tmp_path / "a.tif")
+    open(fn, "w").close()
+    quarantine_file = str(tmp_path / "quarantine.txt")
+
+    registry = FailureRegistry(quarantine_file, max_attempts=2)
+    registry.failed(fn, now=0)
+    registry.failed(fn, now=10)
+    assert not registry.ready(fn, now=1000)
+
+    # Quarantine list survives restarts
+    assert FailureRegistry(quarantine_file).quarantined(fn)
+    assert not FailureRegistry(quarantine_file).ready(fn)
+
+    # A rewritten file is retried
+    with open(fn, "w") as f:
+        f.write("new data")
+    assert not FailureRegistry(quarantine_file).quarantined(fn)
+    assert FailureRegistry(quarantine_file).ready(fn)
+
+
+def test_quarantine_edited(tmp_path):
+    fn = str(tmp_path / "a.tif")
+    open(fn, "w").close()
+    quarantine_file = str(tmp_path / "quarantine.txt")
+    FailureRegistry(quarantine_file, max_attempts=1).failed(fn)
+
+    # Blank and garbled lines left after editing the list by hand are ignored
+    with open(quarantine_file, "a") as f:
+        f.write("\n  \nnot a key\nb.tif\tx\t1\n")
+    registry = FailureRegistry(quarantine_file)
+    assert registry.quarantined(fn)
+    assert len(registry.quarantine) == 1
+
+
+def test_join_waits_for_parts(tmp_path):
+    processed = []
+
+    def func(tiff_file, outfile, **kwargs):
+        processed.append(find_movie_parts(tiff_file))
+        open(outfile, "w").close()
+
+    def acquire(name, age):
+        fn = tmp_path / name
+        fn.write_bytes(b"")
+        os.utime(fn, (time() - age, time() - age))
+        return str(fn)
+
+    kwargs = dict(pattern=str(tmp_path / "*.tif"), join=True, settle=30)
+    registry = FailureRegistry()
+
+    # The parts of the movie are written one after another
+    head = acquire("movie.tif", age=40)
+    acquire("movie_1.tif", age=35)
+    acquire("movie_2.tif", age=5)
+    process_files("_out.csv", func, registry, **kwargs)
+    assert processed == []
+
+    acquire("movie_2.tif", age=31)
+    acquire("movie_3.tif", age=0)
+    process_files("_out.csv", func, registry, **kwargs)
+    assert processed == []
+
+    # Acquisition has finished, all parts are processed together as one movie
+    acquire("movie_3.tif", age=31)
+    process_files("_out.csv", func, registry, **kwargs)
+    process_files("_out.csv", func, registry, **kwargs)
+    assert processed == [[head] + [str(tmp_path / f"movie_{i}.tif") for i in [1, 2, 3]]]
+
+
+def test_metrics_without_output(tmp_path):
+    def func(tiff_file, outfile, **kwargs):
+        # A new file is acquired while this one is processed, and no output is created
+        (tmp_path / "new.tif").write_bytes(b"")
+
+    (tmp_path / "movie.tif").write_bytes(b"")
+    kwargs = dict(pattern=str(tmp_path / "*.tif"))
+    registry, no_output = FailureRegistry(), set()
+    processed, skipped = METRICS.processed, METRICS.no_output
+
+    process_files("_out.csv", func, registry, no_output, **kwargs)
+    assert METRICS.processed == processed
+    assert METRICS.no_output == skipped + 1
+    assert list(METRICS.pending) == [str(tmp_path / "new.tif")]
+
+    # Files without output are not processed again, and don't count as pending
+    process_files("_out.csv", func, registry, no_output, **kwargs)
+    process_files("_out.csv", func, registry, no_output, **kwargs)
+    assert METRICS.no_output == skipped + 2
+    assert METRICS.pending == {}
+
+
+def test_metrics_split_movie(tmp_path):
+    # The first part has been written long ago, but the acquisition is still running
+    head = tmp_path / "movie.tif"
+    head.write_bytes(b"")
+    os.utime(head, (0, 0))
+    (tmp_path / "movie_1.tif").write_bytes(b"")
+
+    kwargs = dict(pattern=str(tmp_path / "*.tif"), join=True, settle=30)
+    process_files("_out.csv", None, FailureRegistry(), **kwargs)
+    assert list(METRICS.pending) == [str(head)]
+    assert METRICS.lag() < 30
+    assert METRICS.health()["status"] == "ok"
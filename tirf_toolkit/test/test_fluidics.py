@@ -0,0 +1,70 @@
+import pytest
+from glob import glob
+from os.path import join
+from tirf_toolkit.fluidics import analyze_df, _savgol_segment
+from scipy.signal import savgol_filter
+import numpy as np
+import pandas as pd
+
+
+def load(fn):
+    df = pd.read_csv(fn, index_col='time').iloc[5:]
+    df.index *= 1000
+    return df
+
+
+@pytest.mark.parametrize("window_length", [11, 19, 301])
+def test_savgol_segment(window_length):
+    y = np.random.default_rng(0).normal(size=2000)
+    full = savgol_filter(y, window_length, 3)
+
+    for lo, hi in [(0, 100), (100, 1500), (1900, 2000), (0, 2000)]:
+        assert np.allclose(_savgol_segment(y, lo, hi, window_length), full[lo:hi])
+
+
+def synthetic_trace(n, seed):
+    """Noisy injection at random times, with transitions up to 1% of the trace long"""
+    rng = np.random.default_rng(seed)
+    x = np.arange(n, dtype=float)
+    start, end = n * rng.uniform(0.3, 0.4), n * rng.uniform(0.5, 0.6)
+    rise, fall = n * rng.uniform(0.002, 0.01, size=2)
+    y = 1000 / (1 + np.exp(np.clip((start - x) / rise, -50, 50))) - \
+        1000 / (1 + np.exp(np.clip((end - x) / fall, -50, 50)))
+    return pd.DataFrame({"Cy3": y + rng.normal(scale=30, size=n)}, index=pd.Index(x, name="time"))
+
+
+def assert_multires(df, window, decimate):
+    """Transition timings deviate from the full-resolution analysis by at most max(1, decimate/2) samples"""
+    _, _, front, back = analyze_df(df.copy(), window=window)
+    _, _, front_mr, back_mr = analyze_df(df.copy(), window=window, decimate=decimate)
+    tol = max(1, decimate / 2) * np.diff(df.index).mean() * 1.01
+
+    for t, t_mr in [(front, front_mr), (back, back_mr)]:
+        assert (t is None) == (t_mr is None)
+        if t:
+            assert t_mr.a == pytest.approx(t.a, abs=tol)
+            assert t_mr.b == pytest.approx(t.b, abs=tol)
+
+
+@pytest.mark.parametrize("window", ["auto", "19"])
+@pytest.mark.parametrize("decimate", [2, 4, 8, 16, 32])
+def test_multires(window, decimate):
+    for fn in sorted(glob(join("tirf_toolkit", "test", "data", "intensity", "*.csv"))):
+        assert_multires(load(fn), window, decimate)
+
+
+@pytest.mark.parametrize("window", ["auto", "19"])
+@pytest.mark.parametrize("decimate", [10, 30, 100])
+def test_multires_long(window, decimate):
+    for seed in range(3):
+        assert_multires(synthetic_trace(10**5, seed), window, decimate)
+
+
+@pytest.mark.parametrize("n", [50, 999])
+def test_multires_short(n):
+    # Traces too short to decimate are analyzed at full resolution
+    df = synthetic_trace(n, 0)
+    _, _, front, back = analyze_df(df.copy())
+    _, _, front_mr, back_mr = analyze_df(df.copy(), decimate=100)
+    for t, t_mr in [(front, front_mr), (back, back_mr)]:
+        assert (t.a, t.b) == (t_mr.a, t_mr.b)
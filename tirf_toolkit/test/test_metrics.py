@@ -0,0 +1,62 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+from tirf_toolkit.metrics import Metrics, serve_metrics
+
+
+@pytest.fixture
+def metrics(tmp_path):
+    fn = tmp_path / "movie.tif"
+    fn.write_bytes(b"")
+    os.utime(fn, (0, 0))   # the file has been waiting for ages
+
+    metrics = Metrics(max_lag=600)
+    metrics.scan([str(fn)])
+    return metrics, str(fn)
+
+
+def test_render(metrics):
+    metrics, fn = metrics
+    metrics.observe("file", 2.0)
+    metrics.add_frames(100, 2.0)
+
+    text = metrics.render()
+    assert "tirf_queue_depth 1\n" in text
+    assert "tirf_frames_total 100\n" in text
+    assert "tirf_frames_per_second 50.000\n" in text
+    assert 'tirf_stage_duration_seconds_bucket{stage="file",le="1"} 0\n' in text
+    assert 'tirf_stage_duration_seconds_bucket{stage="file",le="5"} 1\n' in text
+    assert 'tirf_stage_duration_seconds_count{stage="file"} 1\n' in text
+    assert 'tirf_worker_memory_bytes{worker="main"}' in text
+
+
+def test_worker_memory():
+    # Memory of worker processes (e.g. of `map_frames`) is reported too
+    with ProcessPoolExecutor(1) as pool:
+        pid = pool.submit(os.getpid).result()
+        assert f"pid{pid}" in Metrics().memory()
+
+
+def test_health_endpoint(metrics):
+    metrics, fn = metrics
+    server = serve_metrics(metrics, port=0)
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    try:
+        with pytest.raises(HTTPError) as e:
+            urlopen(url + "/health")
+        assert e.value.code == 503
+        assert json.loads(e.value.read())["status"] == "behind"
+
+        metrics.done(fn)
+        health = json.loads(urlopen(url + "/health").read())
+        assert health["status"] == "ok"
+        assert health["queue_depth"] == 0
+
+        assert b"tirf_files_processed_total 1" in urlopen(url + "/metrics").read()
+    finally:
+        server.shutdown()
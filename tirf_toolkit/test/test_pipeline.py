@@ -0,0 +1,40 @@
+import pytest
+from tirf_toolkit.pipeline import map_frames
+from tirf_toolkit.intensity import frame_intensity, analyze_intensity
+from tirf_toolkit.particles import count_particles, count_frame_particles
+from tirf_toolkit.tirf_image import TIRFimage
+from tirf_toolkit.test.test_tirf_image import write_stack
+import numpy as np
+
+
+def test_map_frames():
+    stack = np.random.default_rng(0).integers(0, 1000, (23, 8, 6), dtype=np.uint16)
+    slices = [np.s_[..., :, :3], np.s_[..., :, 3:]]
+
+    means = map_frames(stack, frame_intensity, n_workers=2, chunk_size=4, n_slots=3, slices=slices)
+    assert np.allclose(means, np.stack([stack[s].mean(axis=(-1, -2)) for s in slices], axis=1))
+
+    assert map_frames(stack[:0], frame_intensity, n_workers=2, slices=slices).shape == (0, 2)
+
+
+@pytest.fixture
+def tirf_image(tmp_path):
+    frames = np.random.default_rng(1).normal(100, 5, (20, 32, 32)).astype(np.uint16)
+    frames[:, 8::8, 8::8] += np.arange(20, dtype=np.uint16)[:, None, None] * 50   # particles appear over time
+    write_stack(str(tmp_path / "movie.tif"), frames)
+    return TIRFimage(str(tmp_path / "movie.tif"))
+
+
+def test_shared_memory_matches_dask(tirf_image):
+    assert np.allclose(analyze_intensity(tirf_image, channels=["Cy3"]),
+                       analyze_intensity(tirf_image, channels=["Cy3"], n_workers=2))
+    assert np.array_equal(count_particles(tirf_image, channels=["Cy3"]),
+                          count_particles(tirf_image, channels=["Cy3"], n_workers=2))
+
+    # Short stack, and stack without frames
+    tirf_image.data = tirf_image.data[:5]
+    assert np.array_equal(count_particles(tirf_image, channels=["Cy3"]),
+                          count_particles(tirf_image, channels=["Cy3"], n_workers=2))
+    counts = map_frames(tirf_image.data[:0], count_frame_particles, n_workers=2, slices=[np.s_[...]],
+                        flat_frames=[np.zeros((32, 32))], biases=[0], thresholds=[100])
+    assert counts.shape == (0, 1)
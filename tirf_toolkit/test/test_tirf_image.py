@@ -0,0 +1,60 @@
+import pytest
+from os.path import join
+from pathlib import Path
+from PIL import Image
+from tirf_toolkit import count_particles
+from tirf_toolkit.tirf_image import TIRFimage, find_movie_parts, is_movie_part
+import numpy as np
+
+
+def write_stack(fn, frames, frame_time=0.01):
+    meta_text = open(join("tirf_toolkit", "test", "data", "meta_1ch.txt")).read()
+    meta_text = "\n".join(line for line in meta_text.splitlines()
+                          if not line.startswith(("width=", "height=", "frameTime=")))
+    meta_text += f"\nframeTime={frame_time}"
+
+    images = [Image.fromarray(frame) for frame in frames]
+    images[0].save(fn, save_all=True, append_images=images[1:], tiffinfo={270: meta_text})
+
+
+@pytest.fixture
+def split_movie(tmp_path):
+    frames = np.arange(7 * 8 * 8, dtype=np.uint16).reshape(7, 8, 8)
+    files = [str(tmp_path / name) for name in ["movie.tif", "movie_1.tif", "movie_2.tif"]]
+    for fn, part in zip(files, np.split(frames, [3, 5])):
+        write_stack(fn, part)
+    return files, frames
+
+
+def test_find_movie_parts(split_movie):
+    files, _ = split_movie
+    assert find_movie_parts(files[0]) == files
+    assert not is_movie_part(files[0])
+    assert is_movie_part(files[1])
+    assert is_movie_part(files[2])
+
+
+def test_split_movie(split_movie):
+    files, frames = split_movie
+    tirf_image = TIRFimage(files)
+
+    assert tirf_image.data.shape == frames.shape
+    assert np.array_equal(tirf_image.Cy3.compute(), frames)
+    assert np.allclose(tirf_image.time, np.arange(7) * 0.01)
+
+
+def test_path(split_movie):
+    files, frames = split_movie
+    assert np.array_equal(TIRFimage(Path(files[0])).Cy3.compute(), frames[:3])
+    assert np.array_equal(TIRFimage([Path(f) for f in files]).Cy3.compute(), frames)
+
+    df = count_particles(Path(files[0]))
+    assert len(df) == 3
+
+
+def test_split_movie_incompatible(split_movie):
+    files, frames = split_movie
+    write_stack(files[2], frames[5:], frame_time=0.02)
+
+    with pytest.raises(ValueError):
+        TIRFimage(files)
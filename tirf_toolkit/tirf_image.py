@@ -1,21 +1,62 @@
 from PIL import Image
 from dask_image import imread
+from os import PathLike
+from os.path import splitext, exists
+import dask.array as da
 import numpy as np
 import re
 
 
 class TIRFimage:
     def __init__(self, tiff_file):
-        self.metadata = _parse_metadata(read_metadata(tiff_file))
+        """
+        Open a TIFF stack as a lazy dask array. `tiff_file` is either a single file name
+        (a string or a path object), or a list of file names holding consecutive parts of one movie (long acquisitions
+        are split into several files). The parts are concatenated along the time axis into
+        a single logical movie; the metadata is taken from the first part.
+        """
+        self.files = [tiff_file] if isinstance(tiff_file, (str, PathLike)) else list(tiff_file)
+        self.metadata = _parse_metadata(read_metadata(self.files[0]))
         self.channels = self.metadata["channels"]
 
-        self.data = imread.imread(tiff_file)
+        for f in self.files[1:]:
+            _check_compatible(self.metadata, _parse_metadata(read_metadata(f)), f)
+
+        parts = [imread.imread(f) for f in self.files]
+        self.data = parts[0] if len(parts) == 1 else da.concatenate(parts, axis=0)
+        self.frameTime = float(self.metadata["frameTime"])
+
+    @classmethod
+    def from_array(cls, data, metadata):
+        """
+        Wrap an in-memory numpy or dask array of shape (frames, height, width), e.g. frames
+        that have just been acquired. `metadata` has the same <key>=<value> pairs as stored
+        in FlashGordon TIFF files (at least `frameTime`, `fieldArrangement`, and names of the
+        channels), either as a block of text or as a dict. Width and height are taken from
+        the array.
+        """
+        if isinstance(metadata, dict):
+            metadata = "\n".join(f"{k}={v}" for k, v in metadata.items())
+
+        self = cls.__new__(cls)
+        self.files = []
+        self.metadata = _parse_metadata(metadata + f"\nwidth={data.shape[-1]}\nheight={data.shape[-2]}")
+        self.channels = self.metadata["channels"]
+
+        # One frame per chunk, the same as for the TIFF files
+        self.data = da.from_array(data, chunks=(1, -1, -1)) if isinstance(data, np.ndarray) else data
         self.frameTime = float(self.metadata["frameTime"])
+        return self
 
     def __repr__(self):
         return self.data.__repr__() + "\n" + \
             "\n".join([f"{k}={v}" for k, v in self.metadata.items()])
 
+    @property
+    def time(self):
+        """Timestamps of the frames in seconds, continuous across all parts of the movie"""
+        return np.arange(self.data.shape[0]) * self.frameTime
+
     @property
     def Cy2(self):
         if "Cy2" in self.metadata["channels"]:
@@ -37,6 +78,45 @@ class TIRFimage:
             return self.data[self.metadata["Cy7_slice"]]
 
 
+def find_movie_parts(tiff_file):
+    """
+    Return the list of files that make up the movie starting with `tiff_file`.
+    Continuation parts follow the Micro-Manager convention: `movie.tif` is followed
+    by `movie_1.tif`, `movie_2.tif`, and so on, until the first missing number.
+    """
+    stem, ext = splitext(tiff_file)
+    if stem.endswith(".ome"):
+        stem, ext = splitext(stem)[0], ".ome" + ext
+
+    parts = [tiff_file]
+    while exists(f"{stem}_{len(parts)}{ext}"):
+        parts.append(f"{stem}_{len(parts)}{ext}")
+    return parts
+
+
+def is_movie_part(tiff_file):
+    """
+    Check whether `tiff_file` is a continuation part (`movie_1.tif`, `movie_2.tif`, ...)
+    of another movie present on disk.
+    """
+    stem, ext = splitext(tiff_file)
+    if stem.endswith(".ome"):
+        stem, ext = splitext(stem)[0], ".ome" + ext
+
+    m = re.fullmatch(r"(.*)_([1-9]\d*)", stem)
+    return bool(m) and exists(m.group(1) + ext)
+
+
+def _check_compatible(metadata, part_metadata, part_file):
+    """
+    Make sure that a continuation part of a movie was acquired with the same settings
+    """
+    for key in ["width", "height", "fieldArrangement", "frameTime", "channels"]:
+        if metadata.get(key) != part_metadata.get(key):
+            raise ValueError(f"Cannot join {part_file} to the movie: {key} is "
+                             f"{part_metadata.get(key)}, expected {metadata.get(key)}")
+
+
 def get_metadata(tiff_file):
     return _parse_metadata(read_metadata(tiff_file))
 